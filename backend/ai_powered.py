@@ -1,11 +1,66 @@
 import pandas as pd
 import numpy as np
-from openai import AzureOpenAI
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 import os
+import re
 import json
 import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
-from sklearn.metrics.pairwise import cosine_similarity
+
+try:
+    import faiss
+except ImportError:  # FAISS is optional; fall back to brute-force search
+    faiss = None
+
+try:
+    import diskcache
+except ImportError:  # diskcache is optional; embeddings are then cached in memory only
+    diskcache = None
+
+# 2024-10-21 or later reports prompt cache hits in usage.prompt_tokens_details
+API_VERSION = "2024-10-21"
+
+# Keep-alive pool shared by concurrent requests; HTTP/2 multiplexes them over few TLS sessions
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+# Above this many tickets, switch from exact search to an HNSW graph
+HNSW_THRESHOLD = 100_000
+
+# Column-name terms used to auto-detect the issue and resolution columns
+ISSUE_TERMS = frozenset(['issue', 'problem', 'description', 'ticket', 'question', 'query', 'case'])
+RESOLUTION_TERMS = frozenset(['resolution', 'solution', 'answer', 'fix', 'response', 'action'])
+
+# Each term set compiled into one pattern, so a column name is scanned once
+# (substring match, so names like "Issue_Description" or "fixes" still match)
+ISSUE_PATTERN = re.compile('|'.join(sorted(ISSUE_TERMS)))
+RESOLUTION_PATTERN = re.compile('|'.join(sorted(RESOLUTION_TERMS)))
+
+# Lower bound on vector norms when normalizing
+NORM_EPSILON = 1e-12
+
+# Number of query embeddings kept in the in-memory cache
+EMBEDDING_CACHE_SIZE = 10_000
+
+# Number of generated resolutions kept for semantic reuse
+RESPONSE_CACHE_SIZE = 1_000
+
+# Static instructions go in the system message, ahead of the per-ticket content,
+# so every request shares the same prefix and Azure can cache it. Keep it free
+# of anything that varies between calls.
+SYSTEM_PROMPT = (
+    "You are an expert support agent that provides accurate and helpful resolutions to tickets based on historical examples.\n\n"
+    "You will be given a JSON array of similar historical tickets, each an object with "
+    "\"sim\" (similarity to the new ticket, 0-1), \"issue\" and \"resolution\", followed by a new ticket. "
+    "Based on these similar historical tickets, provide a comprehensive resolution for the new ticket. "
+    "Focus on accuracy and relevance. If the similar tickets don't seem relevant enough, "
+    "indicate that this might need a different approach."
+)
 
 class AITicketResolver:
     """
@@ -14,38 +69,59 @@ class AITicketResolver:
     2. Azure OpenAI to understand and generate accurate resolutions
     """
     
-    def __init__(self, api_key, endpoint, embedding_deployment="text-embedding-ada-002", completion_deployment="gpt-4o"):
-        """Initialize the AI ticket resolver with Azure OpenAI credentials."""
+    def __init__(self, api_key, endpoint, embedding_deployment="text-embedding-ada-002", completion_deployment="gpt-4o",
+                 cache_dir="emb_cache"):
+        """
+        Initialize the AI ticket resolver with Azure OpenAI credentials.
+        
+        Query embeddings are cached in memory and, if diskcache is installed,
+        on disk under cache_dir (pass None to disable the disk cache).
+        """
         self.api_key = api_key
         self.endpoint = endpoint
         self.embedding_deployment = embedding_deployment
         self.completion_deployment = completion_deployment
         self.historical_data = None
         self.embeddings = None
+        self.index = None
         self.column_mapping = None
         
+        self._emb_cache = OrderedDict()
+        self._emb_lock = threading.Lock()
+        # fingerprint -> [embedding matrix, results, filled slots, next slot] ring buffer
+        self._resp_cache = {}
+        self._resp_lock = threading.Lock()
+        # Bumped on every clear, so answers built from replaced data are never stored
+        self._resp_generation = 0
+        self._disk_cache = diskcache.Cache(cache_dir) if diskcache is not None and cache_dir else None
+        
         # Initialize Azure OpenAI client
         self.client = AzureOpenAI(
             api_key=api_key,
-            api_version="2023-05-15",
-            azure_endpoint=endpoint
+            api_version=API_VERSION,
+            azure_endpoint=endpoint,
+            http_client=DefaultHttpxClient(http2=True, limits=HTTP_LIMITS)
         )
         
         print(f"Initialized AI Ticket Resolver with {completion_deployment}")
     
-    def load_data(self, file_path, issue_col=None, resolution_col=None):
+    def load_data(self, file_path, issue_col=None, resolution_col=None, file_name=None):
         """
         Load historical ticket data and detect columns.
         
         Args:
-            file_path: Path to CSV or Excel file
+            file_path: Path to CSV or Excel file, or a file-like object
             issue_col: Column name for issue descriptions (auto-detected if None)
             resolution_col: Column name for resolutions (auto-detected if None)
+            file_name: Name used to detect the format of a file-like object
         """
+        if file_name is None:
+            file_name = file_path
+        
         # Load the data
-        if file_path.endswith('.csv'):
+        if file_name.endswith('.csv'):
             self.historical_data = pd.read_csv(file_path)
-        elif file_path.endswith(('.xlsx', '.xls')):
+        elif file_name.endswith(('.xlsx', '.xls')):
             self.historical_data = pd.read_excel(file_path)
         else:
             raise ValueError("Unsupported file format. Use CSV or Excel.")
@@ -56,7 +132,7 @@ class AITicketResolver:
         # Clean the data
         self._clean_data()
         
-        print(f"Loaded {len(self.historical_data)} records from {os.path.basename(file_path)}")
+        print(f"Loaded {len(self.historical_data)} records from {os.path.basename(file_name)}")
         print(f"Using '{self.column_mapping['issue']}' for issues and '{self.column_mapping['resolution']}' for resolutions")
         
         return self
@@ -65,25 +141,22 @@ class AITicketResolver:
         """Auto-detect issue and resolution columns if not specified."""
         columns = self.historical_data.columns
         mapping = {}
+        text_lengths = None
         
         # For issue column
         if issue_col and issue_col in columns:
             mapping['issue'] = issue_col
         else:
             # Try to detect based on common naming patterns
-            issue_candidates = [
-                col for col in columns if any(term in col.lower() for term in 
-                ['issue', 'problem', 'description', 'ticket', 'question', 'query', 'case'])
-            ]
+            issue_candidates = [col for col in columns if ISSUE_PATTERN.search(str(col).lower())]
             
             if issue_candidates:
                 mapping['issue'] = issue_candidates[0]
             else:
                 # Use the column with the longest text on average
-                text_lengths = {col: self.historical_data[col].astype(str).str.len().mean() 
-                               for col in columns if self.historical_data[col].dtype == 'object'}
-                if text_lengths:
-                    mapping['issue'] = max(text_lengths, key=text_lengths.get)
+                text_lengths = self._text_lengths()
+                if len(text_lengths):
+                    mapping['issue'] = text_lengths.idxmax()
                 else:
                     raise ValueError("Could not detect issue description column")
         
@@ -92,58 +165,80 @@ class AITicketResolver:
             mapping['resolution'] = resolution_col
         else:
             # Try to detect based on common naming patterns
-            resolution_candidates = [
-                col for col in columns if any(term in col.lower() for term in 
-                ['resolution', 'solution', 'answer', 'fix', 'response', 'action'])
-            ]
+            resolution_candidates = [col for col in columns if RESOLUTION_PATTERN.search(str(col).lower())]
             
             if resolution_candidates:
                 mapping['resolution'] = resolution_candidates[0]
             else:
                 # Use remaining text columns excluding the issue column
-                remaining_text_cols = [col for col in columns 
-                                      if col != mapping.get('issue') 
-                                      and self.historical_data[col].dtype == 'object']
+                if text_lengths is None:
+                    text_lengths = self._text_lengths()
+                remaining_lengths = text_lengths.drop(mapping.get('issue'), errors='ignore')
                 
-                if remaining_text_cols:
+                if len(remaining_lengths):
                     # Use the one with the longest average text
-                    text_lengths = {col: self.historical_data[col].astype(str).str.len().mean() 
-                                  for col in remaining_text_cols}
-                    mapping['resolution'] = max(text_lengths, key=text_lengths.get)
+                    mapping['resolution'] = remaining_lengths.idxmax()
                 else:
                     raise ValueError("Could not detect resolution column")
         
         return mapping
     
+    def _text_lengths(self):
+        """Average text length of every text column, computed in a single pass."""
+        text_data = self.historical_data.select_dtypes(include='object')
+        if text_data.columns.empty:
+            # apply() on a frame without columns returns a DataFrame, not a Series
+            return pd.Series(dtype=float)
+        return text_data.astype(str).apply(lambda col: col.str.len().mean())
+    
     def _clean_data(self):
         """Clean and preprocess the data."""
+        self.historical_data = self.clean_data(
+            self.historical_data, self.column_mapping['issue'], self.column_mapping['resolution']
+        )
+        
+        print(f"After cleaning: {len(self.historical_data)} valid records remain")
+    
+    @staticmethod
+    def clean_data(data, issue_col, resolution_col):
+        """
+        Return a cleaned copy of ticket data: string issue and resolution
+        columns, no empty rows, and no duplicate issues.
+        """
         # Ensure columns contain string data
-        issue_col = self.column_mapping['issue']
-        resolution_col = self.column_mapping['resolution']
+        data = data.assign(**{
+            issue_col: data[issue_col].astype(str),
+            resolution_col: data[resolution_col].astype(str)
+        })
         
-        self.historical_data[issue_col] = self.historical_data[issue_col].astype(str)
-        self.historical_data[resolution_col] = self.historical_data[resolution_col].astype(str)
+        # Issue text ignoring case and whitespace differences
+        normalized_issues = (data[issue_col].str.lower()
+                             .str.replace(r'\s+', ' ', regex=True).str.strip())
         
         # Remove rows with empty issues or resolutions
-        self.historical_data = self.historical_data[
-            (self.historical_data[issue_col].str.strip() != '') & 
-            (self.historical_data[resolution_col].str.strip() != '')
-        ]
+        has_issue = normalized_issues.astype(bool)
+        has_resolution = data[resolution_col].str.strip().astype(bool)
+        valid = has_issue & has_resolution
         
-        # Remove duplicates based on issue descriptions
-        self.historical_data.drop_duplicates(subset=[issue_col], inplace=True)
-        
-        print(f"After cleaning: {len(self.historical_data)} valid records remain")
+        # Remove duplicates based on normalized issue descriptions, so case and
+        # whitespace variants don't each pay for an embedding
+        return data[valid][~normalized_issues[valid].duplicated()]
     
-    def generate_embeddings(self, batch_size=100, max_retries=3, retry_delay=1):
+    def generate_embeddings(self, batch_size=100, max_retries=3, retry_delay=1, max_concurrency=8,
+                            use_quantization=False):
         """
         Generate embeddings for historical tickets using Azure OpenAI.
-        Uses batching to handle large datasets efficiently.
+        Uses batching to handle large datasets efficiently, with several
+        batches in flight at once.
         
         Args:
             batch_size: Number of texts to process in each batch
             max_retries: Maximum number of retry attempts for API calls
-            retry_delay: Delay between retries in seconds
+            retry_delay: Initial delay between retries in seconds (doubles per attempt)
+            max_concurrency: Maximum number of batch requests in flight; keep it
+                under the deployment's rate limit
+            use_quantization: Store the search index as 8-bit scalar-quantized
+                vectors (4x smaller, slightly approximate scores); requires FAISS
         """
         if self.historical_data is None:
             raise ValueError("No historical data loaded. Call load_data first.")
@@ -151,62 +246,176 @@ class AITicketResolver:
         issue_col = self.column_mapping['issue']
         issues = self.historical_data[issue_col].tolist()
         total_issues = len(issues)
+        if total_issues == 0:
+            raise ValueError("No valid records to embed.")
         
         print(f"Generating embeddings for {total_issues} historical tickets...")
         
-        # Initialize embeddings list
-        all_embeddings = []
+        batches = [issues[i:i+batch_size] for i in range(0, total_issues, batch_size)]
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            batch_results = asyncio.run(
+                self._embed_batches(batches, max_retries, retry_delay, max_concurrency)
+            )
+        else:
+            # asyncio.run cannot nest inside a running event loop (async servers,
+            # notebooks), so overlap the requests with threads on the sync client
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                batch_results = list(executor.map(
+                    lambda n, batch: self._embed_batch_sync(batch, n, len(batches), max_retries, retry_delay),
+                    range(1, len(batches) + 1), batches
+                ))
+        
+        # Results come back in batch order; copy them into one float32 matrix
+        embeddings = np.empty((total_issues, len(batch_results[0][0])), dtype=np.float32)
+        for i, batch_embeddings in zip(range(0, total_issues, batch_size), batch_results):
+            embeddings[i:i+len(batch_embeddings)] = batch_embeddings
+        
+        self.embeddings = embeddings
+        self._clear_resolution_cache()
+        print(f"Generated {len(self.embeddings)} embeddings, shape: {self.embeddings.shape}")
+        
+        self._normalize_embeddings()
+        self._build_index(use_quantization)
         
-        # Process in batches
-        for i in range(0, total_issues, batch_size):
-            batch = issues[i:i+batch_size]
-            batch_size = len(batch)
-            
-            retry_count = 0
-            success = False
-            
-            while not success and retry_count < max_retries:
+        return self
+    
+    async def _embed_batches(self, batches, max_retries, retry_delay, max_concurrency):
+        """Embed all batches concurrently, returning the results in batch order."""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        # A fresh async client per run: its connection pool is tied to this event loop
+        async with AsyncAzureOpenAI(
+            api_key=self.api_key,
+            api_version=API_VERSION,
+            azure_endpoint=self.endpoint,
+            http_client=DefaultAsyncHttpxClient(http2=True, limits=HTTP_LIMITS)
+        ) as client:
+            return await asyncio.gather(*(
+                self._embed_batch(client, semaphore, batch, n, len(batches), max_retries, retry_delay)
+                for n, batch in enumerate(batches, 1)
+            ))
+    
+    async def _embed_batch(self, client, semaphore, batch, batch_number, total_batches, max_retries, retry_delay):
+        """Embed a single batch, retrying with exponential backoff (e.g. on 429s)."""
+        async with semaphore:
+            for attempt in range(1, max_retries + 1):
                 try:
-                    # Request embeddings for the batch - updated to use deployment name
-                    response = self.client.embeddings.create(
+                    response = await client.embeddings.create(
                         input=batch,
                         model=self.embedding_deployment
                     )
-                    
-                    # Extract embeddings from response
-                    batch_embeddings = [item.embedding for item in response.data]
-                    all_embeddings.extend(batch_embeddings)
-                    
-                    success = True
-                    print(f"Processed batch {i//batch_size + 1}/{(total_issues + batch_size - 1)//batch_size}")
-                    
+                    print(f"Processed batch {batch_number}/{total_batches}")
+                    return [item.embedding for item in response.data]
+                
                 except Exception as e:
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        print(f"Error generating embeddings (attempt {retry_count}/{max_retries}): {e}")
-                        print(f"Retrying in {retry_delay} seconds...")
-                        time.sleep(retry_delay)
-                    else:
-                        print(f"Failed to generate embeddings after {max_retries} attempts: {e}")
-                        raise
-        
-        # Store embeddings
-        self.embeddings = np.array(all_embeddings)
-        print(f"Generated {len(all_embeddings)} embeddings, shape: {self.embeddings.shape}")
-        
-        return self
+                    await asyncio.sleep(self._backoff_delay(e, batch_number, attempt, max_retries, retry_delay))
+    
+    def _embed_batch_sync(self, batch, batch_number, total_batches, max_retries, retry_delay):
+        """Blocking variant of _embed_batch for use from worker threads."""
+        for attempt in range(1, max_retries + 1):
+            try:
+                response = self.client.embeddings.create(
+                    input=batch,
+                    model=self.embedding_deployment
+                )
+                print(f"Processed batch {batch_number}/{total_batches}")
+                return [item.embedding for item in response.data]
+            
+            except Exception as e:
+                time.sleep(self._backoff_delay(e, batch_number, attempt, max_retries, retry_delay))
+    
+    @staticmethod
+    def _backoff_delay(error, batch_number, attempt, max_retries, retry_delay):
+        """
+        Retry policy shared by the async and threaded batch paths: log the failed
+        attempt and return the exponential backoff delay, or re-raise the error
+        once max_retries attempts have been used.
+        """
+        if attempt >= max_retries:
+            print(f"Failed to generate embeddings after {max_retries} attempts: {error}")
+            raise error
+        
+        delay = retry_delay * 2 ** (attempt - 1)
+        print(f"Error generating embeddings for batch {batch_number} (attempt {attempt}/{max_retries}): {error}")
+        print(f"Retrying in {delay} seconds...")
+        return delay
+    
+    def _normalize_embeddings(self):
+        """L2-normalize embeddings in place so cosine similarity is a plain dot product."""
+        # The clip keeps an all-zero vector at zero instead of turning it into NaNs
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True).clip(min=NORM_EPSILON)
+    
+    def _build_index(self, use_quantization=False):
+        """
+        Build a FAISS inner-product index over the L2-normalized embeddings.
+        Inner product on unit vectors equals cosine similarity.
+        """
+        self.index = None
+        if faiss is None:
+            if use_quantization:
+                print("FAISS is not installed; ignoring use_quantization")
+            return
+        
+        dim = self.embeddings.shape[1]
+        large = len(self.embeddings) > HNSW_THRESHOLD
+        
+        if use_quantization:
+            # One byte per dimension, scored with int8 SIMD dot products
+            qtype = faiss.ScalarQuantizer.QT_8bit
+            if large:
+                self.index = faiss.IndexHNSWSQ(dim, qtype, 32, faiss.METRIC_INNER_PRODUCT)
+            else:
+                self.index = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_INNER_PRODUCT)
+            self.index.train(self.embeddings)
+        elif large:
+            # Approximate search with logarithmic query time for large corpora
+            self.index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        else:
+            self.index = faiss.IndexFlatIP(dim)
+        self.index.add(self.embeddings)
     
     def get_embedding(self, text):
-        """Generate an embedding for a single text."""
-        try:
-            response = self.client.embeddings.create(
-                input=[text],
-                model=self.embedding_deployment
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            print(f"Error generating embedding: {e}")
-            raise
+        """
+        Generate an embedding for a single text, reusing cached results for repeated texts.
+        
+        Returns a read-only float32 vector, the dtype the search index works in.
+        """
+        # Endpoint and deployment together identify the model (deployment names are
+        # chosen per Azure resource), so a model swap never returns stale vectors
+        key = hashlib.blake2b(f"{self.endpoint}|{self.embedding_deployment}|{text}".encode(), digest_size=16).hexdigest()
+        
+        with self._emb_lock:
+            embedding = self._emb_cache.get(key)
+        if embedding is None and self._disk_cache is not None:
+            embedding = self._disk_cache.get(key)
+        
+        if embedding is None:
+            try:
+                response = self.client.embeddings.create(
+                    input=[text],
+                    model=self.embedding_deployment
+                )
+                embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
+            except Exception as e:
+                print(f"Error generating embedding: {e}")
+                raise
+            
+            if self._disk_cache is not None:
+                self._disk_cache.set(key, embedding)
+        
+        # Shared with every caller through the cache, so it must not be modified
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding.flags.writeable = False
+        
+        with self._emb_lock:
+            self._emb_cache[key] = embedding
+            self._emb_cache.move_to_end(key)
+            if len(self._emb_cache) > EMBEDDING_CACHE_SIZE:
+                self._emb_cache.popitem(last=False)
+        
+        return embedding
     
     def save_embeddings(self, file_path):
         """Save embeddings to a file for future use."""
@@ -215,13 +424,74 @@ class AITicketResolver:
         
         np.save(file_path, self.embeddings)
         print(f"Saved embeddings to {file_path}")
+        
+        # Written after the array, so its presence also means the file is complete
+        with open(self._metadata_path(file_path), 'w') as f:
+            json.dump({"normalized": True}, f)
+        
+        if self.index is not None:
+            index_path = self._index_path(file_path)
+            faiss.write_index(self.index, index_path)
+            print(f"Saved search index to {index_path}")
     
     def load_embeddings(self, file_path):
-        """Load embeddings from a file."""
-        self.embeddings = np.load(file_path)
+        """
+        Load embeddings from a file.
+        
+        The embeddings and the FAISS index are memory-mapped read-only, so pages
+        are read on demand and shared through the page cache instead of being
+        copied into memory. Files without the metadata written by save_embeddings
+        are read once to check normalization.
+        Raises ValueError if the file's row count doesn't match the loaded data.
+        """
+        # Row-major float32 so each embedding is one contiguous run for the
+        # matrix-vector product (and as FAISS requires), whatever the file's layout.
+        # Files written by save_embeddings already match, so no copy is made.
+        embeddings = np.ascontiguousarray(np.load(file_path, mmap_mode='r'), dtype=np.float32)
+        
+        # Rows must line up with the loaded tickets, or results would point at the wrong ones
+        if self.historical_data is not None and len(embeddings) != len(self.historical_data):
+            raise ValueError(
+                f"Embeddings in {file_path} have {len(embeddings)} rows "
+                f"but {len(self.historical_data)} tickets are loaded"
+            )
+        
+        # save_embeddings records that its output is normalized; other files may
+        # not be, and those are normalized into memory since the mapping is read-only
+        metadata_path = self._metadata_path(file_path)
+        metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        
+        if not metadata.get("normalized"):
+            squared_norms = np.einsum('ij,ij->i', embeddings, embeddings)
+            if not np.allclose(squared_norms, 1, atol=1e-3):
+                embeddings = embeddings / np.sqrt(squared_norms).clip(min=NORM_EPSILON)[:, None]
+        
+        self.embeddings = embeddings
+        self._clear_resolution_cache()
         print(f"Loaded embeddings from {file_path}, shape: {self.embeddings.shape}")
+        
+        index_path = self._index_path(file_path)
+        if faiss is not None and os.path.exists(index_path):
+            # IO_FLAG_MMAP only applies to IVF lists; MMAP_IFC maps flat/SQ/HNSW vector storage
+            self.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC)
+            print(f"Loaded search index from {index_path}")
+        else:
+            self._build_index()
         return self
     
+    @staticmethod
+    def _index_path(file_path):
+        """Path of the FAISS index stored alongside an embeddings file."""
+        return os.path.splitext(file_path)[0] + ".faiss"
+    
+    @staticmethod
+    def _metadata_path(file_path):
+        """Path of the metadata stored alongside an embeddings file."""
+        return os.path.splitext(file_path)[0] + ".json"
+    
     def find_similar_tickets(self, new_ticket, top_n=5, threshold=0.7):
         """
         Find similar historical tickets using vector similarity.
@@ -237,24 +507,31 @@ class AITicketResolver:
         if self.embeddings is None:
             raise ValueError("No embeddings available. Call generate_embeddings or load_embeddings first.")
         
-        # Generate embedding for the new ticket
-        new_embedding = self.get_embedding(new_ticket)
+        return self._find_similar(self._query_embedding(new_ticket), top_n, threshold)
+    
+    def _query_embedding(self, text):
+        """Embed a ticket as a normalized float32 vector."""
+        query = self.get_embedding(text).copy()
+        query /= max(np.linalg.norm(query), NORM_EPSILON)
+        return query
+    
+    def _find_similar(self, query, top_n, threshold):
+        """Find similar historical tickets for a normalized query embedding."""
+        if self.index is not None:
+            return self._search_index(query, top_n, threshold)
         
-        # Calculate similarities with all historical tickets
-        similarities = cosine_similarity(
-            [new_embedding],
-            self.embeddings
-        )[0]
+        # Cosine similarity with all historical tickets as a single matrix-vector product
+        similarities = self.embeddings @ query
         
         # Filter by threshold
         valid_indices = np.where(similarities >= threshold)[0]
         
         if len(valid_indices) == 0:
             # Fallback: use top 3 regardless of threshold if no good matches
-            top_indices = np.argsort(similarities)[-min(3, len(similarities)):][::-1]
+            top_indices = self._top_k(similarities, np.arange(len(similarities)), 3)
         else:
             # Get indices of top N similar tickets
-            top_indices = valid_indices[np.argsort(similarities[valid_indices])[-min(top_n, len(valid_indices)):]][::-1]
+            top_indices = self._top_k(similarities, valid_indices, top_n)
         
         # Create a DataFrame with similar tickets and their similarity scores
         similar_tickets = self.historical_data.iloc[top_indices].copy()
@@ -262,7 +539,36 @@ class AITicketResolver:
         
         return similar_tickets
     
-    def get_resolution(self, new_ticket, top_n=3, include_examples=True):
+    @staticmethod
+    def _top_k(scores, candidates, k):
+        """Return the k candidate indices with the highest scores, best first."""
+        k = min(k, len(candidates))
+        # Partial selection is O(N); only the k survivors get sorted
+        top = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        return top[np.argsort(-scores[top])]
+    
+    def _search_index(self, query, top_n, threshold):
+        """Find similar tickets with the FAISS index, same semantics as the brute-force path."""
+        # Results come back sorted by descending score, so the matches above
+        # the threshold form a prefix; k also covers the top-3 fallback
+        k = min(max(top_n, 3), self.index.ntotal)
+        scores, indices = self.index.search(query[None, :], k)
+        found = indices[0] >= 0
+        scores, indices = scores[0][found], indices[0][found]
+        
+        valid = scores >= threshold
+        if valid.any():
+            top = slice(0, min(top_n, int(valid.sum())))
+        else:
+            # Fallback: use top 3 regardless of threshold if no good matches
+            top = slice(0, 3)
+        
+        similar_tickets = self.historical_data.iloc[indices[top]].copy()
+        similar_tickets['similarity_score'] = scores[top]
+        
+        return similar_tickets
+    
+    def get_resolution(self, new_ticket, top_n=3, include_examples=True, cache_threshold=0.92):
         """
         Get AI-generated resolution for a new ticket.
         
@@ -270,12 +576,29 @@ class AITicketResolver:
             new_ticket: Description of the new ticket
             top_n: Number of similar tickets to consider
             include_examples: Whether to include similar examples in the output
+            cache_threshold: Minimum similarity to a previously resolved ticket
+                for its resolution to be reused instead of calling the model
             
         Returns:
             Dictionary with resolution information
         """
+        if self.embeddings is None:
+            raise ValueError("No embeddings available. Call generate_embeddings or load_embeddings first.")
+        
+        # Taken before touching the data; if it changes meanwhile, the answer is stale
+        with self._resp_lock:
+            generation = self._resp_generation
+        
+        query = self._query_embedding(new_ticket)
+        
+        # Reuse the resolution of a near-identical ticket answered earlier
+        fingerprint = (self.completion_deployment, hashlib.blake2b(SYSTEM_PROMPT.encode()).hexdigest(), top_n, include_examples)
+        cached = self._lookup_resolution(fingerprint, query, cache_threshold)
+        if cached is not None:
+            return cached
+        
         # Find similar tickets
-        similar_tickets = self.find_similar_tickets(new_ticket, top_n=top_n)
+        similar_tickets = self._find_similar(query, top_n, threshold=0.7)
         
         if len(similar_tickets) == 0:
             return {
@@ -288,37 +611,33 @@ class AITicketResolver:
         issue_col = self.column_mapping['issue']
         resolution_col = self.column_mapping['resolution']
         
-        # Create context with examples for the AI
-        context = "Here are some similar historical tickets and their resolutions:\n\n"
+        # Read the three fields column-wise; tolist() also yields plain Python floats
+        issues = similar_tickets[issue_col].tolist()
+        resolutions = similar_tickets[resolution_col].tolist()
+        similarities = similar_tickets['similarity_score'].tolist()
         
-        examples = []
-        for i, (_, ticket) in enumerate(similar_tickets.iterrows(), 1):
-            example = {
-                "issue": ticket[issue_col],
-                "resolution": ticket[resolution_col],
-                "similarity": float(ticket['similarity_score'])
-            }
-            examples.append(example)
-            
-            context += f"Example {i} (Similarity: {ticket['similarity_score']:.2f}):\n"
-            context += f"Issue: {ticket[issue_col]}\n"
-            context += f"Resolution: {ticket[resolution_col]}\n\n"
-        
-        # Build the prompt for the AI
-        prompt = (
-            f"{context}\n"
-            f"New Ticket: {new_ticket}\n\n"
-            f"Based on these similar historical tickets, provide a comprehensive resolution for the new ticket. "
-            f"Focus on accuracy and relevance. If the similar tickets don't seem relevant enough, "
-            f"indicate that this might need a different approach."
+        examples = [
+            {"issue": issue, "resolution": resolution, "similarity": similarity}
+            for issue, resolution, similarity in zip(issues, resolutions, similarities)
+        ]
+        
+        # Create context with examples for the AI as compact JSON (schema described in SYSTEM_PROMPT)
+        context = json.dumps(
+            [{"sim": round(similarity, 2), "issue": issue, "resolution": resolution}
+             for issue, resolution, similarity in zip(issues, resolutions, similarities)],
+            ensure_ascii=False,
+            separators=(',', ':')
         )
         
+        # Build the prompt for the AI; only the variable part, the instructions live in SYSTEM_PROMPT
+        prompt = f"Similar historical tickets:\n{context}\n\nNew Ticket: {new_ticket}"
+        
         # Get resolution from Azure OpenAI - updated to use deployment name
         try:
             response = self.client.chat.completions.create(
                 model=self.completion_deployment,
                 messages=[
-                    {"role": "system", "content": "You are an expert support agent that provides accurate and helpful resolutions to tickets based on historical examples."},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
@@ -327,6 +646,10 @@ class AITicketResolver:
             
             resolution = response.choices[0].message.content
             
+            details = getattr(response.usage, 'prompt_tokens_details', None)
+            if details is not None and details.cached_tokens:
+                print(f"Prompt cache hit: {details.cached_tokens}/{response.usage.prompt_tokens} prompt tokens")
+            
             # Calculate confidence based on similarity scores
             best_similarity = similar_tickets.iloc[0]['similarity_score'] if len(similar_tickets) > 0 else 0
             confidence = "high" if best_similarity >= 0.85 else "medium" if best_similarity >= 0.75 else "low"
@@ -337,6 +660,7 @@ class AITicketResolver:
                 "similar_tickets": examples if include_examples else []
             }
             
+            self._store_resolution(fingerprint, query, result, generation)
             return result
             
         except Exception as e:
@@ -346,7 +670,47 @@ class AITicketResolver:
                 "confidence": "low",
                 "similar_tickets": examples if include_examples else []
             }
-
+    
+    def _lookup_resolution(self, fingerprint, query, threshold):
+        """Return a cached resolution whose ticket is at least threshold-similar to the query."""
+        with self._resp_lock:
+            entry = self._resp_cache.get(fingerprint)
+            if entry is None:
+                return None
+            
+            embeddings, results, count, _ = entry
+            similarities = embeddings[:count] @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                return None
+            
+            return {**results[best], "cached": True}
+    
+    def _store_resolution(self, fingerprint, query, result, generation):
+        """
+        Remember a generated resolution for semantic reuse, replacing the oldest when full.
+        Skipped if the cache was cleared since generation was read.
+        """
+        with self._resp_lock:
+            if generation != self._resp_generation:
+                return
+            
+            entry = self._resp_cache.get(fingerprint)
+            if entry is None:
+                entry = [np.empty((RESPONSE_CACHE_SIZE, len(query)), dtype=np.float32), [None] * RESPONSE_CACHE_SIZE, 0, 0]
+                self._resp_cache[fingerprint] = entry
+            
+            embeddings, results, count, slot = entry
+            embeddings[slot] = query
+            results[slot] = result
+            entry[2] = min(count + 1, RESPONSE_CACHE_SIZE)
+            entry[3] = (slot + 1) % RESPONSE_CACHE_SIZE
+    
+    def _clear_resolution_cache(self):
+        """Forget cached resolutions, e.g. after the historical data changes."""
+        with self._resp_lock:
+            self._resp_cache.clear()
+            self._resp_generation += 1
 
 # Example usage
 if __name__ == "__main__":
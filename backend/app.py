@@ -1,15 +1,60 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import json
+import orjson
+import hashlib
 import pandas as pd
 import os
 from ai_powered import AITicketResolver  # Import your AITicketResolver class
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, which is faster and serializes NumPy values natively"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)  # Enable cross-origin requests
 
 # Initialize the resolver (with placeholder values, will be updated via API)
 resolver = None
+# Fingerprint of the data and embedding model the resolver's embeddings were built from
+resolver_fingerprint = None
+
+# Embeddings saved per fingerprint so restarts and repeated settings don't re-embed
+EMBEDDINGS_DIR = 'embeddings_cache'
+
+def data_fingerprint(df, endpoint, embedding_deployment):
+    """
+    Hash the ticket data together with the embedding model that embeds it.
+    Deployment names are chosen per Azure resource, so the endpoint is needed
+    to identify the model.
+    """
+    digest = hashlib.sha256(df.to_csv(index=False).encode())
+    digest.update(f"\0{endpoint}\0{embedding_deployment}".encode())
+    return digest.hexdigest()
+
+def prepare_embeddings(fingerprint):
+    """Load saved embeddings for this fingerprint, or generate and save them."""
+    global resolver_fingerprint
+    file_path = os.path.join(EMBEDDINGS_DIR, f"{fingerprint}.npy")
+    
+    try:
+        resolver.load_embeddings(file_path)
+    except (FileNotFoundError, ValueError) as e:
+        # Missing, or saved for a different row set (e.g. older cleaning rules)
+        if os.path.exists(file_path):
+            print(f"Regenerating embeddings: {e}")
+        resolver.generate_embeddings()
+        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+        resolver.save_embeddings(file_path)
+    
+    resolver_fingerprint = fingerprint
 
 @app.route('/api/settings', methods=['POST'])
 def update_settings():
@@ -17,14 +62,6 @@ def update_settings():
     settings = request.json
     global resolver
     
-    # Initialize the resolver with new settings
-    resolver = AITicketResolver(
-        api_key=settings['apiKey'],
-        endpoint=settings['endpoint'],
-        embedding_deployment=settings['embeddingModel'],
-        completion_deployment=settings['completionModel']
-    )
-    
     try:
         # Create a sample dataset if needed
         sample_data = {
@@ -44,16 +81,33 @@ def update_settings():
             ]
         }
         
-        # Use in-memory data for testing
-        df = pd.DataFrame(sample_data)
+        # Use in-memory data for testing; fingerprint the cleaned rows, which are what gets embedded
+        column_mapping = {'issue': 'issue_description', 'resolution': 'solution'}
+        df = AITicketResolver.clean_data(pd.DataFrame(sample_data), column_mapping['issue'], column_mapping['resolution'])
+        fingerprint = data_fingerprint(df, settings['endpoint'], settings['embeddingModel'])
+        
+        # Nothing to rebuild if the same settings are posted again
+        if (resolver is not None and resolver.embeddings is not None
+                and resolver_fingerprint == fingerprint
+                and resolver.api_key == settings['apiKey']
+                and resolver.endpoint == settings['endpoint']
+                and resolver.completion_deployment == settings['completionModel']):
+            return jsonify({"status": "success", "message": "Settings unchanged, reusing embeddings"})
+        
+        # Initialize the resolver with new settings
+        resolver = AITicketResolver(
+            api_key=settings['apiKey'],
+            endpoint=settings['endpoint'],
+            embedding_deployment=settings['embeddingModel'],
+            completion_deployment=settings['completionModel']
+        )
         
-        # Set up historical data
+        # Set up historical data (already cleaned above)
         resolver.historical_data = df
-        resolver.column_mapping = {'issue': 'issue_description', 'resolution': 'solution'}
-        resolver._clean_data()
+        resolver.column_mapping = column_mapping
         
-        # Generate embeddings
-        resolver.generate_embeddings()
+        # Load or generate embeddings
+        prepare_embeddings(fingerprint)
         
         return jsonify({"status": "success", "message": "Settings updated and embeddings generated"})
     
@@ -102,29 +156,21 @@ def upload_data():
         return jsonify({"status": "error", "message": "No file selected"}), 400
     
     try:
-        # Save file temporarily
-        file_path = 'temp_upload.csv'
-        file.save(file_path)
-        
         # Initialize resolver if not already done
         global resolver
         if not resolver:
             return jsonify({"status": "error", "message": "Please configure API settings first"}), 400
         
-        # Load data
-        resolver.load_data(file_path)
+        # Parse the upload straight from the request stream, no temporary copy on disk
+        resolver.load_data(file.stream, file_name=file.filename)
         
-        # Generate embeddings
-        resolver.generate_embeddings()
+        # Load or generate embeddings
+        prepare_embeddings(data_fingerprint(resolver.historical_data, resolver.endpoint, resolver.embedding_deployment))
         
         return jsonify({"status": "success", "message": f"Loaded {len(resolver.historical_data)} records and generated embeddings"})
     
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        # Clean up temporary file
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
@@ -0,0 +1,14 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+
+# The resolver (settings, data, embeddings) lives in process memory, so a
+# single worker process is used; concurrency comes from threads, which
+# overlap the blocking Azure OpenAI round-trips of concurrent requests.
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", "16"))
+
+# Generating embeddings for a large upload can take a while
+timeout = 300